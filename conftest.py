@@ -0,0 +1,24 @@
+"""Pytest configuration shared by the test suite."""
+
+from dotenv import load_dotenv
+
+
+def pytest_configure(config):
+    """Loads .env and picks how async tests run.
+
+    The .env file is read once per process, before any test module is
+    imported. Under pytest-xdist the concurrent group is dropped and
+    pytest-asyncio runs the async tests one at a time. pytest-asyncio-concurrent
+    and xdist both replace pytest's run loop, and the worker processes already
+    give -n runs their parallelism. --collect-only runs no tests, so it
+    keeps the configured plugins and mode.
+    """
+    load_dotenv()
+
+    if config.option.collectonly:
+        return
+    if getattr(config.option, "numprocesses", None) or hasattr(config, "workerinput"):
+        plugin = config.pluginmanager.get_plugin("asyncio-concurrent")
+        if plugin is not None:
+            config.pluginmanager.unregister(plugin)
+        config.option.asyncio_mode = "auto"
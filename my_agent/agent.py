@@ -1,17 +1,37 @@
 import asyncio
-from google.adk.agents import LlmAgent, SequentialAgent
+import copy
+import hashlib
+import itertools
+import math
+import re
+from collections import OrderedDict
+from google.adk.agents import BaseAgent, LlmAgent, ParallelAgent, SequentialAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.events import Event, EventActions
+from google.adk.artifacts import InMemoryArtifactService
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
-from google.adk.tools import FunctionTool
+from google.adk.utils.instructions_utils import inject_session_state
 from google.genai import types
-from typing import List, Optional
-from pydantic import BaseModel, Field
-from datetime import datetime
+from typing import AsyncGenerator, List, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import date, datetime, timedelta
 from time import gmtime, strftime
 
+from .instructions import (
+    BREAK_DAYS_PER_WEEK,
+    DEFAULT_CHAPTER_PAGES,
+    MAX_DAILY_HOURS,
+    MIN_SESSION_HOURS,
+    TIME_PER_10_PAGES,
+)
+
 
 class Chapter(BaseModel):
     """Represents a chapter from a textbook with metadata for scheduling."""
+    model_config = ConfigDict(frozen=True)
+
     name: str = Field(description="Chapter title or number")
     page_count: int = Field(
         description="Estimated number of pages in this chapter")
@@ -19,10 +39,16 @@ class Chapter(BaseModel):
     estimated_complexity: str = Field(
         description="Complexity level: 'low', 'medium', or 'high'"
     )
+    course: Optional[str] = Field(
+        default=None,
+        description="Course this chapter belongs to, when several are planned together"
+    )
 
 
 class TopicList(BaseModel):
     """Structured extraction of course information from uploaded textbooks."""
+    model_config = ConfigDict(frozen=True)
+
     course_name: str = Field(description="Name of the course")
     total_pages: int = Field(
         description="Total number of pages in the textbook")
@@ -32,10 +58,37 @@ class TopicList(BaseModel):
         default=None,
         description="Key topics likely to appear on the exam"
     )
+    exam_date: Optional[str] = Field(
+        default=None,
+        description="Exam date or deadline from the user's message, as YYYY-MM-DD, "
+                    "or MM-DD when no year is given"
+    )
+    max_daily_hours: Optional[float] = Field(
+        default=None,
+        description="Daily study limit the user asked for, in hours"
+    )
+
+    @classmethod
+    def from_state(cls, data: dict) -> "TopicList":
+        """Rebuilds a TopicList from session state without validating it.
+
+        The state comes from this pipeline: the extractor's schema-checked
+        JSON, merge_topic_lists or the text fast path (both built from model
+        dumps or model_construct). Only the shape is checked; values are
+        passed through as stored.
+        """
+        if not isinstance(data, dict) or "chapters" not in data:
+            raise ValueError("topics state is not a TopicList")
+        return cls.model_construct(**{
+            **data,
+            "chapters": [Chapter.model_construct(**c) for c in data["chapters"]],
+        })
 
 
 class StudyDay(BaseModel):
     """Represents one day in the study schedule."""
+    model_config = ConfigDict(frozen=True)
+
     day: int = Field(description="Day number in the schedule (1, 2, 3, ...)")
     date: Optional[str] = Field(
         default=None,
@@ -51,28 +104,52 @@ class StudyDay(BaseModel):
 
 class FullPlan(BaseModel):
     """Complete study plan spanning multiple days."""
+    model_config = ConfigDict(frozen=True)
+
     plan: List[StudyDay] = Field(description="Day-by-day study schedule")
     total_study_days: int = Field(
         description="Total number of study days (excluding breaks)")
     total_hours: float = Field(description="Total estimated study hours")
+    exam_date: Optional[str] = Field(
+        default=None,
+        description="Exam date the plan was fitted to (YYYY-MM-DD), if one was given"
+    )
+    fits_before_exam: Optional[bool] = Field(
+        default=None,
+        description="Whether the plan ends before the exam; None when undated"
+    )
+
+    @classmethod
+    def from_state(cls, data: dict) -> "FullPlan":
+        """Rebuilds a FullPlan from scheduler state without validating it."""
+        if not isinstance(data, dict) or "plan" not in data:
+            raise ValueError("raw_schedule state is not a FullPlan")
+        return cls.model_construct(**{
+            **data,
+            "plan": [StudyDay.model_construct(**d) for d in data["plan"]],
+        })
 
 
 MODEL = "gemini-3-flash-preview"
 
-# Tool to save markdown file as downloadable artifact
+# Distinguishes plans saved within the same second
+_plan_counter = itertools.count(1)
+
+
+# Saves the markdown study plan as a downloadable artifact
 async def save_study_plan(markdown_content: str, tool_context) -> str:
     """Saves the study plan as a downloadable markdown file.
 
     Args:
         markdown_content: The markdown text to save
-        tool_context: The tool context (injected by ADK)
+        tool_context: Any ADK context with save_artifact (tool or callback)
 
     Returns:
         Confirmation message with filename
     """
     # Create filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"study_plan_{timestamp}.md"
+    filename = f"study_plan_{timestamp}_{next(_plan_counter):04d}.md"
 
     try:
         # Create artifact with markdown content
@@ -81,7 +158,7 @@ async def save_study_plan(markdown_content: str, tool_context) -> str:
             mime_type="text/markdown"
         )
 
-        # Save artifact directly through tool_context
+        # Save artifact directly through the context
         version = await tool_context.save_artifact(
             filename=filename,
             artifact=artifact,
@@ -93,8 +170,6 @@ async def save_study_plan(markdown_content: str, tool_context) -> str:
     except Exception as e:
         return f"Error saving file: {str(e)}. However, the study plan is shown above."
 
-save_plan_tool = FunctionTool(save_study_plan)
-
 extractor = LlmAgent(
     name="ExtractorAgent",
     model=MODEL,
@@ -118,6 +193,11 @@ extractor = LlmAgent(
    - Make reasonable estimates for page counts (assume 30-50 pages per chapter)
    - Estimate complexity based on course level and topic names
 
+**Deadlines and Limits:**
+- If the user gives an exam date or deadline, set exam_date (YYYY-MM-DD, or MM-DD if no year is given)
+- If the user limits daily study time (e.g. "max 3 hours per day"), set max_daily_hours
+- Leave both empty when the user does not mention them
+
 **Page Count Estimation:**
 - Carefully count or estimate pages per chapter from the table of contents
 - If exact counts unavailable, estimate based on section density
@@ -136,96 +216,666 @@ extractor = LlmAgent(
     output_schema=TopicList,
 )
 
-scheduler = LlmAgent(
-    name="SchedulerAgent",
-    model=MODEL,
-    instruction="""You are creating a realistic, day-by-day study schedule for a student preparing for midterm exams.
-
-**Input Data:**
-You will receive {topics} containing:
-- Course information with chapters
-- Page counts and complexity levels
-- Total material to cover
-
-**Scheduling Strategy:**
-1. **Time Estimation Rules:**
-   - Low complexity: ~15-20 minutes per 10 pages
-   - Medium complexity: ~25-35 minutes per 10 pages
-   - High complexity: ~40-60 minutes per 10 pages
-   - Add buffer time for problem sets and review
-
-2. **Daily Constraints (MUST FOLLOW):**
-   - Maximum 4 hours of focused study per day
-   - Minimum 0.5 hours per study session (or 0 for break)
-   - All estimated_hours must be ≤ 4.0
-   - All estimated_hours must be ≥ 0.0
-
-3. **Break Management:**
-   - Include at least one break day (0 hours) per week
-   - Consider lighter days (1-2 hours) periodically
-   - Build in review days near the exam
-
-4. **Task Allocation:**
-   - Prioritize complex material earlier in the schedule
-   - Group related chapters together
-   - Include review sessions for each completed section
-   - Leave final 1-2 days for comprehensive review
-
-5. **Day Numbering:**
-   - Start with day=1 and increment sequentially
-   - Days should represent consecutive calendar days
+FORMATTER_INSTRUCTION = """Introduce the study schedule given under INPUT DATA.
+
+**Your Task:**
+1. Start with a Markdown heading naming the course(s), e.g. "# Study Schedule: Math 135"
+2. Follow it with two or three sentences summarising the plan: number of study days, total hours, and how the days are spread
+3. Repeat the exam date note, or the warning that the plan runs past the exam, from under the table
+
+**Important:**
+- Do not reproduce the table; the schedule table is appended below your text automatically
+- Do not call any tools; the plan is saved as a downloadable file automatically"""
+
+
+async def formatter_instruction(ctx: ReadonlyContext) -> str:
+    """Builds the formatter prompt with the time of the current invocation.
+
+    The static rules come first and the per-request time and schedule last,
+    so repeated calls share a cacheable prompt prefix. ADK skips `{state}`
+    injection for instruction providers, so the schedule is injected here.
+    """
+    now = strftime("%a, %d %b %Y %H:%M:%S +0000", gmtime())
+    return FORMATTER_INSTRUCTION + await inject_session_state(
+        f"\n\n---\nThe time is {now}.\n\nINPUT DATA:\n" + "{schedule_table}", ctx)
+
+
+async def save_formatted_plan(callback_context: CallbackContext) -> types.Content:
+    """Appends the schedule table to the formatter's introduction and saves it.
+
+    The table is copied from `schedule_table` instead of being re-emitted by
+    the LLM, so it always matches `raw_schedule` and costs no output tokens.
+    The full plan goes to `study_plan` and the artifact; the table alone is
+    returned as the formatter's final content, after the streamed intro.
+    """
+    intro = (callback_context.state.get(formatter.output_key) or "").strip()
+    table = callback_context.state.get("schedule_table", "")
+    markdown_content = f"{intro}\n\n{table}" if intro else table
+    callback_context.state["study_plan"] = markdown_content
+    callback_context.state["study_plan_saved"] = await save_study_plan(
+        markdown_content, callback_context)
+    return types.Content(role="model", parts=[types.Part(text=table)])
 
-**Output Requirements:**
-- Create a complete day-by-day plan from today until the midterm
-- Include specific tasks (e.g., "Study Chapter 3: Linear Transformations, complete exercises")
-- Ensure total study time covers all material reasonably
-- Balance workload across available days
-- Calculate total_study_days (days with study hours > 0) and total_hours
-
-**Example Day:**
-Day 3: Study Chapters 2-3 on Proofs and Induction, review exercises (3.5 hours)
-
-**Critical:**
-- NEVER exceed 4 hours per day
-- ALWAYS include at least one break per week
-- Make the plan realistic and achievable""",
-    output_key="raw_schedule",
-    output_schema=FullPlan
-)
 
 formatter = LlmAgent(
     name="FormatterAgent",
     model=MODEL,
-    instruction=f"The time is {strftime("%a, %d %b %Y %H:%M:%S +0000", gmtime())}." + """Convert the study schedule {raw_schedule} into a well-formatted Markdown table.
+    instruction=formatter_instruction,
+    output_key="plan_intro",
+    after_agent_callback=save_formatted_plan,
+)
 
-**Your Task:**
-1. Create a markdown table with columns: Day | Date | Course | Chapter | Task | Hours
-2. Use proper Markdown table syntax with | separators
-3. Include a header row with column names and a separator row with dashes
-4. After creating the table, call save_study_plan to make it downloadable
-5. ALWAYS output the complete markdown table in your final response
-
-**Example Format:**
-```markdown
-# Study Schedule
-
-| Day | Date | Course | Chapter | Task | Hours |
-|-----|------|--------|---------|------|-------|
-| 1 | 2026-02-09 | Math 135 | Chapter 1-2 | Introduction to proofs | 3.5 |
-| 2 | 2026-02-10 | Math 135 | Chapter 3 | Mathematical induction | 4.0 |
-| 3 | 2026-02-11 | - | - | Break day | 0.0 |
-```
+PDF_MIME_TYPE = "application/pdf"
 
-**Important:**
-- First, call save_study_plan with the markdown content
-- Then, output the complete markdown table as your response""",
-    tools=[save_plan_tool]
+
+def _is_pdf(part: types.Part) -> bool:
+    """Checks whether a message part is an uploaded PDF."""
+    return bool(part.inline_data and part.inline_data.mime_type == PDF_MIME_TYPE)
+
+
+def _pdf_parts(content: Optional[types.Content]) -> List[types.Part]:
+    """Returns the PDF attachments of a user message, in upload order."""
+    if not content or not content.parts:
+        return []
+    return [part for part in content.parts if _is_pdf(part)]
+
+
+def _message_text(content: Optional[types.Content]) -> str:
+    """Joins the text parts of a user message."""
+    if not content or not content.parts:
+        return ""
+    return " ".join(part.text for part in content.parts if part.text)
+
+
+def _restrict_to_pdf(pdf: types.Part):
+    """Builds a before_model_callback that hides every PDF except `pdf`.
+
+    Each per-textbook extractor sees the full conversation, so the other
+    uploads are stripped from its request to keep the call to one textbook.
+    """
+    def callback(callback_context, llm_request):
+        contents = []
+        for content in llm_request.contents:
+            parts = [
+                part for part in content.parts or []
+                if not _is_pdf(part) or part.inline_data.data == pdf.inline_data.data
+            ]
+            if parts:
+                contents.append(types.Content(role=content.role, parts=parts))
+        llm_request.contents = contents
+        return None
+
+    return callback
+
+
+def merge_topic_lists(topic_lists: List[dict]) -> dict:
+    """Combines per-textbook extractions into the single `topics` entry.
+
+    Each chapter records the course it came from, so the scheduler can still
+    tell the textbooks apart after merging. The earliest exam date and the
+    tightest daily limit win.
+
+    Args:
+        topic_lists: TopicList dicts as stored in session state
+
+    Returns:
+        One TopicList dict covering every textbook
+    """
+    if len(topic_lists) == 1:
+        return topic_lists[0]
+
+    chapters = []
+    exam_topics = []
+    for topics in topic_lists:
+        for chapter in topics["chapters"]:
+            chapters.append({"course": topics["course_name"], **chapter})
+        exam_topics.extend(topics.get("exam_topics") or [])
+
+    merged = {
+        "course_name": " + ".join(t["course_name"] for t in topic_lists),
+        "total_pages": sum(t["total_pages"] for t in topic_lists),
+        "chapters": chapters,
+    }
+    if exam_topics:
+        merged["exam_topics"] = exam_topics
+    exam_dates = [t["exam_date"] for t in topic_lists if t.get("exam_date")]
+    if exam_dates:
+        merged["exam_date"] = min(exam_dates)
+    limits = [t["max_daily_hours"] for t in topic_lists if t.get("max_daily_hours")]
+    if limits:
+        merged["max_daily_hours"] = min(limits)
+    return merged
+
+
+# "Course: Data Structures" or a course code such as "Math 136 - Linear Algebra"
+_LIST_KEYWORD = r"\b(?:chapters?|topics?|covers)\b"
+# A "Course:" label ends at punctuation or where the chapter list begins
+_COURSE_LABEL_RE = re.compile(
+    r"\bcourse\s*:\s*([^.,;\n]+?)(?=\s*(?:[.,;\n]|$|" + _LIST_KEYWORD + r"))",
+    re.IGNORECASE,
+)
+# Month names are excluded so exam dates like "Feb 20" are not course codes
+_COURSE_CODE_RE = re.compile(
+    r"\b(?!(?i:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?"
+    r"|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b)"
+    r"([A-Z][A-Za-z]{1,4} ?\d{2,3}[A-Z]?\b(?:\s*[:\-\u2013]\s*[^.,;\n]+)?)")
+# "Chapters: ...", "Topics include: ...", "Course covers: ..."; numbered
+# items ("1. Sets") and dotted section numbers ("1.2 Logic") stay in the list
+_CHAPTER_LIST_RE = re.compile(
+    r"\b(?:chapters?|topics?|covers)(?:\s+(?:include|covered))?\s*:\s*"
+    r"((?:\d+(?:\.\d+)+|\d+[.)]\s|[^.])+)",
+    re.IGNORECASE,
+)
+_LIST_KEYWORD_RE = re.compile(_LIST_KEYWORD, re.IGNORECASE)
+# Only punctuation, or a "Course"/"Textbook" lead-in, may sit between the
+# course name and its list; anything else is prose the parser can't read
+_COURSE_TO_LIST_GAP_RE = re.compile(
+    r"(?:[\s.,;:\-\u2013]|\b(?:course|textbook)\b)*", re.IGNORECASE)
+# Digits, brackets, colons and sentence punctuation inside a chapter name
+# mean the "list" carries page counts, ranges or prose
+_DOUBTFUL_NAME_RE = re.compile(r"[\d()\[\]:.!?\u2013\u2014]|\s-\s")
+_MAX_CHAPTER_NAME_WORDS = 5
+_LIST_SEPARATOR_RE = re.compile(r"\s*[,;]\s*")
+_ITEM_PREFIX_RE = re.compile(
+    r"^(?:and\s+)?(?:\d+(?:\.\d+)+[.)]?\s+|\d+[.)]\s*)?", re.IGNORECASE)
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun",
+           "jul", "aug", "sep", "oct", "nov", "dec")
+# "exam on 2026-12-10", "midterm is Feb 20", "due by December 3, 2026"
+_EXAM_DATE_RE = re.compile(
+    r"\b(?:exam|midterm|final|test|deadline|due)\b[^.\n]*?"
+    r"(?:(\d{4}-\d{2}-\d{2})|\b([a-z]{3})[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?"
+    r"(?:,?\s+(\d{4}))?\b)",
+    re.IGNORECASE,
 )
+# "max 3 hours per day", "at most 2.5 hrs a day", "up to 3h daily"
+_DAILY_LIMIT_RE = re.compile(
+    r"\b(?:max(?:imum)?|at most|up to|no more than)\s+(\d+(?:\.\d+)?)\s*"
+    r"(?:hours?|hrs?|h)\s*(?:(?:per|a|each)\s+day|daily)\b",
+    re.IGNORECASE,
+)
+
+
+def _chapter_names(listing: str) -> Optional[List[str]]:
+    """Splits a comma-separated chapter listing into chapter names.
+
+    A listing only continues onto the next line after a trailing comma; any
+    other following line is prose, and None is returned.
+    """
+    lines = [line for line in listing.strip().splitlines() if line.strip()]
+    kept = lines[:1]
+    for line in lines[1:]:
+        if not kept[-1].rstrip().endswith(","):
+            return None
+        kept.append(line)
+
+    names = []
+    for item in _LIST_SEPARATOR_RE.split(" ".join(kept)):
+        name = _ITEM_PREFIX_RE.sub("", item.strip()).strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def _exam_date(text: str) -> Optional[str]:
+    """Finds the exam date in a message, as YYYY-MM-DD or MM-DD without a year."""
+    match = _EXAM_DATE_RE.search(text)
+    if not match:
+        return None
+    iso, month, day, year = match.groups()
+    if iso:
+        return iso
+    if month.lower() not in _MONTHS:
+        return None
+    month_day = f"{_MONTHS.index(month.lower()) + 1:02d}-{int(day):02d}"
+    return f"{year}-{month_day}" if year else month_day
+
+
+def _daily_limit(text: str) -> Optional[float]:
+    """Finds a daily study limit such as "max 3 hours per day" in a message."""
+    match = _DAILY_LIMIT_RE.search(text)
+    return float(match.group(1)) if match else None
+
+
+def try_extract_from_text_description(text: str) -> Optional[TopicList]:
+    """Parses a plain-text course description without an LLM call.
+
+    Only fires when the text names the course (a "Course:" label or a
+    course code such as "STAT 230") and lists its chapters or topics after
+    a colon. Each chapter gets DEFAULT_CHAPTER_PAGES pages and medium
+    complexity, the same defaults the extractor is told to assume. An exam
+    date and a daily limit stated in the text are carried over.
+
+    Anything doubtful is left to the extractor: several course codes, prose
+    between the course and its list or after the list, and chapter names
+    that carry digits, brackets, colons or sentence punctuation or that run
+    past a few words.
+
+    Args:
+        text: The user's message
+
+    Returns:
+        The extracted TopicList, or None when the text needs the extractor
+    """
+    # Several course codes need splitting across courses, which the
+    # extractor does and this parser does not
+    if len(_COURSE_CODE_RE.findall(text)) > 1:
+        return None
+    # The date and limit sentences are read here and then blanked, so the
+    # course and chapter patterns never see them
+    exam_date = _exam_date(text)
+    max_daily_hours = _daily_limit(text)
+    text = _EXAM_DATE_RE.sub(" ", _DAILY_LIMIT_RE.sub(" ", text))
+    course = _COURSE_LABEL_RE.search(text) or _COURSE_CODE_RE.search(text)
+    listing = _CHAPTER_LIST_RE.search(text)
+    if not course or not listing or course.end() > listing.start():
+        return None
+    if not _COURSE_TO_LIST_GAP_RE.fullmatch(text[course.end():listing.start()]):
+        return None
+    if text[listing.end():].strip(" \t\n.,;"):
+        return None
+
+    course_name = course.group(1).strip()
+    names = _chapter_names(listing.group(1))
+    if not names or _LIST_KEYWORD_RE.search(course_name):
+        return None
+    if any(_DOUBTFUL_NAME_RE.search(name)
+           or len(name.split()) > _MAX_CHAPTER_NAME_WORDS for name in names):
+        return None
+
+    return TopicList.model_construct(
+        course_name=course_name,
+        total_pages=DEFAULT_CHAPTER_PAGES * len(names),
+        chapters=[
+            Chapter.model_construct(
+                name=name,
+                page_count=DEFAULT_CHAPTER_PAGES,
+                topics=[],
+                estimated_complexity="medium",
+            )
+            for name in names
+        ],
+        exam_topics=None,
+        exam_date=exam_date,
+        max_daily_hours=max_daily_hours,
+    )
+
+
+# Extractions of already-seen textbooks, keyed by _extraction_cache_key and
+# kept in least-recently-used order. Entries are private copies: sessions get
+# their own deep copy on a hit, so editing one session's topics never leaks
+# into another's.
+_EXTRACTION_CACHE_MAX = 128
+_extraction_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _cached_extraction(key: str) -> Optional[dict]:
+    """Returns a copy of a cached extraction, marking it recently used."""
+    if key not in _extraction_cache:
+        return None
+    _extraction_cache.move_to_end(key)
+    return copy.deepcopy(_extraction_cache[key])
+
+
+def _cache_extraction(key: str, topics: dict) -> None:
+    """Stores a copy of an extraction, evicting the least recently used."""
+    _extraction_cache[key] = copy.deepcopy(topics)
+    _extraction_cache.move_to_end(key)
+    while len(_extraction_cache) > _EXTRACTION_CACHE_MAX:
+        _extraction_cache.popitem(last=False)
+
+
+def _extraction_cache_key(pdf: types.Part, text: str) -> str:
+    """Keys a PDF's extraction on its bytes, the user's text and the model.
+
+    The text is part of the key because it steers the extractor (e.g. "only
+    chapters 1-4 are on the midterm").
+    """
+    digest = hashlib.blake2b(MODEL.encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(pdf.inline_data.data)
+    return digest.hexdigest()
+
+
+class TextbookFanOutAgent(BaseAgent):
+    """Runs the extractor once per uploaded PDF, concurrently.
+
+    Textbooks analyzed before with the same accompanying text are served
+    from an in-process LRU cache keyed on both. The rest get one extractor
+    clone each, dispatched through a ParallelAgent when there are several,
+    and all TopicLists are merged into the extractor's output key. If any
+    clone finishes without writing its TopicList, the plain extractor runs
+    on the whole message instead of merging a partial result. Without
+    PDFs, a course description that try_extract_from_text_description can
+    parse skips the LLM call; anything else goes to the extractor as-is.
+    """
+
+    async def _run_async_impl(self, ctx) -> AsyncGenerator[Event, None]:
+        extractor_agent = self.sub_agents[0]
+        pdfs = _pdf_parts(ctx.user_content)
+
+        if not pdfs:
+            topics = try_extract_from_text_description(_message_text(ctx.user_content))
+            if topics is not None:
+                yield self._topics_event(ctx, topics.model_dump(exclude_none=True))
+                return
+            async for event in extractor_agent.run_async(ctx):
+                yield event
+            return
+
+        text = _message_text(ctx.user_content)
+        cache_keys = [_extraction_cache_key(pdf, text) for pdf in pdfs]
+        results = {}
+        for i, key in enumerate(cache_keys):
+            cached = _cached_extraction(key)
+            if cached is not None:
+                results[i] = cached
+
+        clones = {
+            f"temp:topics_{i}": (i, extractor_agent.clone(update={
+                "name": f"{extractor_agent.name}_{i}",
+                "output_key": f"temp:topics_{i}",
+                "before_model_callback": _restrict_to_pdf(pdf),
+            }))
+            for i, pdf in enumerate(pdfs) if i not in results
+        }
+        if clones:
+            agents = [clone for _, clone in clones.values()]
+            if len(agents) == 1:
+                run = agents[0]
+            else:
+                run = ParallelAgent(
+                    name=f"{extractor_agent.name}FanOut", sub_agents=agents)
+
+            async for event in run.run_async(ctx):
+                for key, (i, _) in clones.items():
+                    if key in event.actions.state_delta:
+                        results[i] = event.actions.state_delta[key]
+                        _cache_extraction(cache_keys[i], results[i])
+                yield event
+
+            # A clone that wrote no TopicList would drop its textbook from
+            # the plan, so the plain extractor reads them all in one call
+            if len(results) < len(pdfs):
+                async for event in extractor_agent.run_async(ctx):
+                    yield event
+                return
+
+        merged = merge_topic_lists([results[i] for i in sorted(results)])
+        yield self._topics_event(ctx, merged)
+
+    def _topics_event(self, ctx, topics: dict) -> Event:
+        """Builds the event that stores the extraction under the extractor's output key."""
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(
+                state_delta={self.sub_agents[0].output_key: topics}),
+        )
+
+
+def _session_hours(hours: float) -> float:
+    """Rounds study time up to whole MIN_SESSION_HOURS sessions."""
+    sessions = max(1, math.ceil(hours / MIN_SESSION_HOURS))
+    return sessions * MIN_SESSION_HOURS
+
+
+def _chapter_hours(chapter: Chapter) -> float:
+    """Estimates study time for a chapter from its length and complexity.
+
+    The complexity is free text from the LLM, so "High " counts as "high".
+    """
+    complexity = (chapter.estimated_complexity or "").strip().lower()
+    minutes_per_10_pages = TIME_PER_10_PAGES.get(
+        complexity, TIME_PER_10_PAGES["medium"])
+    return _session_hours(chapter.page_count / 10 * minutes_per_10_pages / 60)
+
+
+def _is_break_day(day: int) -> bool:
+    """Checks whether a day number falls on one of the week's break days."""
+    return (day - 1) % 7 >= 7 - BREAK_DAYS_PER_WEEK
+
+
+def _resolve_exam_date(value: Optional[str], start: date) -> Optional[date]:
+    """Turns an extracted exam date into a date.
+
+    A date without a year ("MM-DD") means its next occurrence on or after
+    start. Values that don't parse give None, so the plan is left undated.
+    """
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        month, day = (int(part) for part in value.split("-"))
+        exam = date(start.year, month, day)
+        return exam if exam >= start else exam.replace(year=start.year + 1)
+    except ValueError:
+        return None
+
+
+def _daily_hours(topics: TopicList) -> float:
+    """Caps MAX_DAILY_HOURS at the user's limit, in whole sessions."""
+    if not topics.max_daily_hours:
+        return MAX_DAILY_HOURS
+    limit = min(MAX_DAILY_HOURS, topics.max_daily_hours)
+    return max(MIN_SESSION_HOURS,
+               math.floor(limit / MIN_SESSION_HOURS) * MIN_SESSION_HOURS)
+
+
+def schedule_from_topics(topics: TopicList, start: Optional[date] = None) -> FullPlan:
+    """Builds a day-by-day study plan from the extracted chapters.
+
+    Chapters keep textbook order. Any chapter longer than the daily limit
+    (MAX_DAILY_HOURS, or the user's max_daily_hours if lower) is split into
+    parts, and the resulting blocks are packed greedily into days of at most
+    that limit. Each week ends with BREAK_DAYS_PER_WEEK break days, and a
+    comprehensive review day closes the plan. Every day names the course of
+    the chapters studied on it.
+
+    With an exam date, the plan must end the day before the exam. If it
+    doesn't fit, break days are dropped; if it still doesn't fit, every
+    chapter is kept anyway and `fits_before_exam` is False. Without an exam date
+    the plan is undated: it runs as long as the material needs and
+    `exam_date` and `fits_before_exam` stay None.
+
+    Args:
+        topics: Extracted course structure
+        start: Date of day 1 (defaults to today)
+
+    Returns:
+        The complete study plan
+    """
+    start = start or date.today()
+    daily_hours = _daily_hours(topics)
+
+    blocks = []
+    for chapter in topics.chapters:
+        course = chapter.course or topics.course_name
+        remaining = _chapter_hours(chapter)
+        parts = math.ceil(remaining / daily_hours)
+        for part in range(1, parts + 1):
+            label = chapter.name if parts == 1 else f"{chapter.name} (part {part}/{parts})"
+            blocks.append((course, label, min(remaining, daily_hours)))
+            remaining -= daily_hours
+
+    study_days = []
+    for course, label, hours in blocks:
+        if not study_days or study_days[-1][2] + hours > daily_hours:
+            study_days.append([[], [], 0.0])
+        study_days[-1][0].append(course)
+        study_days[-1][1].append(label)
+        study_days[-1][2] += hours
+
+    study_hours = sum(hours for _, _, hours in study_days)
+    study_days.append(
+        [None, None, min(daily_hours, _session_hours(study_hours / 4))])
+
+    def lay_out(with_breaks: bool) -> List[StudyDay]:
+        plan = []
+
+        def add_day(course: str, chapter: str, task: str, hours: float):
+            day = len(plan) + 1
+            plan.append(StudyDay.model_construct(
+                day=day,
+                date=(start + timedelta(days=day - 1)).isoformat(),
+                course=course,
+                chapter=chapter,
+                task=task,
+                estimated_hours=hours,
+            ))
+
+        for courses, labels, hours in study_days:
+            while with_breaks and _is_break_day(len(plan) + 1):
+                add_day("-", "-", "Break day", 0.0)
+            if labels is None:
+                add_day(topics.course_name, "All chapters",
+                        "Comprehensive review and practice problems", hours)
+            else:
+                add_day(" + ".join(dict.fromkeys(courses)), ", ".join(labels),
+                        f"Study {', '.join(labels)}, complete exercises", hours)
+        return plan
+
+    plan = lay_out(with_breaks=True)
+    exam = _resolve_exam_date(topics.exam_date, start)
+    fits_before_exam = None
+    if exam is not None:
+        days_left = (exam - start).days
+        if len(plan) > days_left:
+            plan = lay_out(with_breaks=False)
+        fits_before_exam = len(plan) <= days_left
+
+    return FullPlan.model_construct(
+        plan=plan,
+        total_study_days=sum(1 for d in plan if d.estimated_hours > 0),
+        total_hours=sum(d.estimated_hours for d in plan),
+        exam_date=exam.isoformat() if exam else None,
+        fits_before_exam=fits_before_exam,
+    )
+
+
+def _table_cell(value) -> str:
+    """Escapes a value for use inside a Markdown table cell.
+
+    Line breaks become spaces so a multi-line name stays on its row.
+    """
+    return " ".join(str(value).splitlines()).replace("|", "\\|")
+
+
+def plan_to_markdown(plan: FullPlan) -> str:
+    """Renders a plan as a Markdown table, one row per study day.
+
+    The formatter reads it to write its introduction (far fewer prompt
+    tokens than the plan's dict form) and the final plan embeds it verbatim.
+    """
+    rows = "\n".join(
+        "| " + " | ".join(_table_cell(cell) for cell in (
+            day.day, day.date or "-", day.course, day.chapter, day.task,
+            f"{day.estimated_hours:.1f}",
+        )) + " |"
+        for day in plan.plan
+    )
+    if plan.exam_date is None:
+        deadline = "No exam date given: this plan is undated and runs as long as the material needs."
+    elif plan.fits_before_exam:
+        deadline = f"Exam: {plan.exam_date}. The plan ends before the exam."
+    else:
+        deadline = (f"Warning: this plan runs past the exam on {plan.exam_date}; "
+                    "there is not enough time to cover every chapter at this daily limit.")
+    return (
+        "| Day | Date | Course | Chapter | Task | Hours |\n"
+        "|-----|------|--------|---------|------|-------|\n"
+        f"{rows}\n\n"
+        f"Total: {plan.total_study_days} study days, {plan.total_hours:.1f} hours\n"
+        f"{deadline}"
+    )
+
+
+class DeterministicSchedulerAgent(BaseAgent):
+    """Schedules the extracted topics in Python with schedule_from_topics.
+
+    Writes the plan to `raw_schedule` and its table rendering to
+    `schedule_table`, which the formatter introduces and appends as-is.
+    """
+
+    async def _run_async_impl(self, ctx) -> AsyncGenerator[Event, None]:
+        topics = TopicList.from_state(ctx.session.state[extractor.output_key])
+        plan = schedule_from_topics(topics)
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(
+                state_delta={
+                    "raw_schedule": plan.model_dump(exclude_none=True),
+                    "schedule_table": plan_to_markdown(plan),
+                }),
+        )
+
+
+extraction = TextbookFanOutAgent(
+    name="TextbookExtraction",
+    sub_agents=[extractor]
+)
+
+scheduler = DeterministicSchedulerAgent(name="SchedulerAgent")
 
 study_pipeline = SequentialAgent(
     name="ExamPlannerPipeline",
-    sub_agents=[extractor, scheduler, formatter]
+    sub_agents=[extraction, scheduler, formatter]
 )
 
 
 root_agent = study_pipeline
+
+# Shared runner for programmatic use, built on first use so importing the
+# module (as `adk web` does, with its own runner) creates no services.
+APP_NAME = "exam_planner"
+
+_runner: Optional[Runner] = None
+
+
+def get_runner() -> Runner:
+    """Returns the shared runner, building it on the first call."""
+    global _runner
+    if _runner is None:
+        _runner = Runner(
+            app_name=APP_NAME,
+            agent=root_agent,
+            session_service=InMemorySessionService(),
+            artifact_service=InMemoryArtifactService(),
+        )
+    return _runner
+
+
+async def create_study_plan(
+    message: Union[str, types.Content],
+    user_id: str = "user",
+    session_id: Optional[str] = None,
+) -> str:
+    """Runs one planning request through the shared runner.
+
+    Args:
+        message: The user's request, as text or a Content with PDF parts
+        user_id: User the session belongs to
+        session_id: Session to create (a fresh id is generated if omitted)
+
+    Returns:
+        The markdown study plan
+    """
+    if isinstance(message, str):
+        message = types.Content(role="user", parts=[types.Part(text=message)])
+
+    runner = get_runner()
+    session = await runner.session_service.create_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    async for _ in runner.run_async(
+            user_id=user_id, session_id=session.id, new_message=message):
+        pass
+
+    session = await runner.session_service.get_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session.id)
+    return session.state.get("study_plan", "")
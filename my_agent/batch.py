@@ -0,0 +1,90 @@
+"""
+Offline study plan generation through the Gemini Batch API.
+
+For queued, non-interactive workloads (e.g. regenerating every student's plan
+overnight) the extractor prompts of many students are submitted as one inline
+batch job, which is billed below realtime calls. Scheduling then runs locally
+with schedule_from_topics, so the batch only carries extractor requests.
+"""
+
+import asyncio
+from typing import List, Optional
+
+from google import genai
+from google.genai import types
+from pydantic import ValidationError
+
+from .agent import MODEL, FullPlan, TopicList, extractor, schedule_from_topics
+
+_FINISHED_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+_SUCCEEDED_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+}
+
+
+def _extraction_request(message: types.Content) -> types.InlinedRequest:
+    """Wraps one student's message as an inline extractor request."""
+    return types.InlinedRequest(
+        contents=[message],
+        config=types.GenerateContentConfig(
+            system_instruction=extractor.instruction,
+            response_mime_type="application/json",
+            response_schema=TopicList,
+        ),
+    )
+
+
+def _plan_from_response(item: Optional[types.InlinedResponse]) -> Optional[FullPlan]:
+    """Schedules one batch result, or returns None if its extraction failed."""
+    if item is None or item.error or not item.response or not item.response.text:
+        return None
+    try:
+        topics = TopicList.model_validate_json(item.response.text)
+    except ValidationError:
+        return None
+    return schedule_from_topics(topics)
+
+
+async def batch_generate_plans(
+    messages: List[types.Content],
+    client: Optional[genai.Client] = None,
+    poll_interval: float = 30.0,
+) -> List[Optional[FullPlan]]:
+    """Generates study plans for many students with one Gemini batch job.
+
+    Args:
+        messages: One user message (course description and/or PDF parts) per student
+        client: Gemini client (defaults to one configured from the environment)
+        poll_interval: Seconds to wait between job status checks
+
+    Returns:
+        One FullPlan per message, in order, or None where extraction failed
+
+    Raises:
+        RuntimeError: If the batch job fails, is cancelled or expires
+    """
+    client = client or genai.Client()
+    job = await client.aio.batches.create(
+        model=MODEL,
+        src=[_extraction_request(message) for message in messages],
+        config=types.CreateBatchJobConfig(display_name="study-plans"),
+    )
+
+    while job.state not in _FINISHED_STATES:
+        await asyncio.sleep(poll_interval)
+        job = await client.aio.batches.get(name=job.name)
+
+    if job.state not in _SUCCEEDED_STATES:
+        raise RuntimeError(f"Batch job {job.name} ended in state {job.state}")
+
+    responses = list(job.dest.inlined_responses or []) if job.dest else []
+    responses += [None] * (len(messages) - len(responses))
+    return [_plan_from_response(item) for item in responses[:len(messages)]]
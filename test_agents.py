@@ -18,21 +18,64 @@ Test Categories:
 """
 
 from my_agent import root_agent, TopicList, FullPlan, Chapter, StudyDay
+import my_agent.agent as planner
+from my_agent.agent import (
+    _cache_extraction,
+    _cached_extraction,
+    _extraction_cache_key,
+    create_study_plan,
+    extractor,
+    formatter,
+    get_runner,
+    merge_topic_lists,
+    plan_to_markdown,
+    schedule_from_topics,
+    try_extract_from_text_description,
+)
+from my_agent.batch import _plan_from_response, batch_generate_plans
 import asyncio
+import json
+from collections import OrderedDict
+from contextlib import aclosing
+from datetime import date
 import time
+import uuid
 import pytest
 import os
+import re
 from pathlib import Path
-from dotenv import load_dotenv
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
+from google.genai import types
 from google.genai.types import Content, Part
-from typing import List
+from typing import Callable, List
 
-load_dotenv()
+NOTES_DIR = Path(__file__).parent / "notes"
 
+# Table cells are split on pipes that are not escaped with a backslash
+TABLE_PIPE_RE = re.compile(r'(?<!\\)\|')
+TABLE_RULE_RE = re.compile(r':?-+:?')
+
+# Break days are free to carry zero hours
+BREAK_TASK_RE = re.compile(r'break|rest', re.IGNORECASE)
+BREAK_CHAPTER_RE = re.compile(r'break', re.IGNORECASE)
 
-NOTES_DIR = Path(__file__).parent / "notes"
+
+@pytest.fixture(scope="session")
+def runner():
+    """One runner for the whole run; tests stay isolated by session_id."""
+    return Runner(app_name="bxtheory tests", agent=root_agent,
+                  session_service=InMemorySessionService())
+
+
+@pytest.fixture(scope="session")
+def math_135_path():
+    """Resolves the Math 135 PDF once per run, skipping if it is missing."""
+    path = NOTES_DIR / "Math_135.pdf"
+    if not path.exists():
+        pytest.skip("Math 135 PDF not found")
+    return path
 
 
 def create_message(text: str) -> Content:
@@ -49,40 +92,45 @@ class AgentResponse:
         self.text = formatted_text  # Formatted markdown output
 
 
-def get_final_response(runner, message_text, user_id="test_user_123", session_id="test_session_456"):
+async def get_final_response(runner, message_text=None, user_id="test_user_123", session_id=None,
+                             message=None):
     """
-    Helper to drain the generator and return a response with structured data.
+    Helper to drain the async generator and return a response with structured data.
+    Each call gets a fresh session unless session_id is given, since the
+    runner is shared across tests. A prebuilt Content can be passed as
+    message instead of message_text to reuse it across runs.
     Returns AgentResponse with:
     - output_data: Dict with 'topics' and 'raw_schedule' from session state
     - text: Formatted markdown output from FormatterAgent
     - final_event: The last Event from the generator
     """
 
-    try:
-        runner.session_service.create_session_sync(
+    session_id = session_id or f"session_{uuid.uuid4().hex}"
+
+    session = await runner.session_service.get_session(
+        user_id=user_id,
+        session_id=session_id,
+        app_name=runner.app_name
+    )
+    if session is None:
+        await runner.session_service.create_session(
             user_id=user_id,
             session_id=session_id,
             app_name=runner.app_name
         )
-    except Exception:
-        # Session might already exis
-        pass
 
-    message = create_message(message_text)
+    if message is None:
+        message = create_message(message_text)
 
-    gen = runner.run(
+    final_event = None
+    async for event in runner.run_async(
         new_message=message,
         user_id=user_id,
         session_id=session_id
-    )
-
-    final_event = None
-    for event in gen:
+    ):
         final_event = event
 
-    time.sleep(0.5)
-
-    session = runner.session_service.get_session_sync(
+    session = await runner.session_service.get_session(
         user_id=user_id,
         session_id=session_id,
         app_name=runner.app_name
@@ -90,17 +138,90 @@ def get_final_response(runner, message_text, user_id="test_user_123", session_id
 
     output_data = {}
     if 'topics' in session.state:
-        output_data['topics'] = TopicList(**session.state['topics'])
+        output_data['topics'] = TopicList.from_state(session.state['topics'])
     if 'raw_schedule' in session.state:
-        output_data['raw_schedule'] = FullPlan(**session.state['raw_schedule'])
+        output_data['raw_schedule'] = FullPlan.from_state(session.state['raw_schedule'])
 
-    formatted_text = ""
-    if final_event and final_event.content and final_event.content.parts:
-        formatted_text = final_event.content.parts[0].text
+    formatted_text = session.state.get('study_plan', "")
 
     return AgentResponse(final_event, output_data, formatted_text)
 
 
+async def get_schedule_only(runner, message_text, user_id="test_user_123"):
+    """
+    Runs the pipeline only until the SchedulerAgent emits raw_schedule and
+    returns it as a FullPlan. Closing the stream there cancels the
+    FormatterAgent call, which constraint-only tests do not need.
+    """
+    session = await runner.session_service.create_session(
+        app_name=runner.app_name, user_id=user_id)
+
+    async with aclosing(runner.run_async(
+        new_message=create_message(message_text),
+        user_id=user_id,
+        session_id=session.id
+    )) as events:
+        async for event in events:
+            if "raw_schedule" in event.actions.state_delta:
+                return FullPlan.from_state(event.actions.state_delta["raw_schedule"])
+
+    pytest.fail("SchedulerAgent should emit raw_schedule")
+
+
+def table_cells(line):
+    """Splits a Markdown table row into its stripped cells."""
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    return [cell.strip() for cell in TABLE_PIPE_RE.split(line)]
+
+
+def parse_markdown_table(text):
+    """
+    Finds the first Markdown table in text: a row followed by a --- rule.
+    Returns the lower-cased header cells and the data rows' cells, or
+    (None, []) when there is no table.
+    """
+    lines = text.splitlines()
+    for i, line in enumerate(lines[:-1]):
+        rule = table_cells(lines[i + 1])
+        if '|' in line and all(TABLE_RULE_RE.fullmatch(cell) for cell in rule):
+            rows = []
+            for row in lines[i + 2:]:
+                if not row.strip().startswith('|'):
+                    break
+                rows.append(table_cells(row))
+            return [cell.lower() for cell in table_cells(line)], rows
+    return None, []
+
+
+def validate_markdown_table(text):
+    """
+    Checks that text holds a schedule table: Day, Task (or Topic) and Hours
+    columns looked up by name, at least one data row, every row as wide as
+    the header, and numeric hours. Returns the column indices and the rows.
+    """
+    header, rows = parse_markdown_table(text)
+    assert header, "Response should contain a markdown table"
+
+    def column(*names):
+        return next((i for i, cell in enumerate(header)
+                     if cell.startswith(names)), None)
+
+    columns = {"day": column("day"), "task": column("task", "topic"),
+               "hours": column("hour")}
+    assert None not in columns.values(), \
+        f"Table should have Day, Task and Hours columns, got {header}"
+    assert rows, "Table should have at least one data row"
+    for row in rows:
+        assert len(row) == len(header), \
+            f"Row {row} should have {len(header)} cells like the header"
+        float(row[columns["hours"]])
+    return columns, rows
+
+
 def validate_schedule_structure(response):
     """Helper to validate the structure of a schedule response."""
     assert response is not None, "Response should not be None"
@@ -112,61 +233,42 @@ def validate_schedule_structure(response):
     assert len(
         schedule_data.plan) > 0, "Schedule should contain at least one study day"
 
-    for entry in schedule_data.plan:
-        assert hasattr(entry, 'day'), "Each entry should have a 'day' field"
-        assert hasattr(entry, 'task'), "Each entry should have a 'task' field"
-        assert hasattr(
-            entry, 'estimated_hours'), "Each entry should have an 'estimated_hours' field"
-        assert hasattr(
-            entry, 'course'), "Each entry should have a 'course' field"
-        assert hasattr(
-            entry, 'chapter'), "Each entry should have a 'chapter' field"
-        assert isinstance(entry.day, int), "Day should be an integer"
-        assert isinstance(entry.task, str), "Task should be a string"
-        assert isinstance(entry.course, str), "Course should be a string"
-        assert isinstance(entry.chapter, str), "Chapter should be a string"
-        assert isinstance(entry.estimated_hours, (int, float)
-                          ), "Hours should be numeric"
-        assert entry.estimated_hours >= 0, "Hours should be non-negative (0 for breaks is allowed)"
-
-    assert "|" in response.text, "Response should contain markdown table separator"
-    assert "Day" in response.text, "Response should contain 'Day' column header"
-    assert "Task" in response.text, "Response should contain 'Task' column header"
+    # One strict validation pass replaces per-field checks: get_final_response
+    # rebuilds the plan with from_state, which skips validation
+    FullPlan.model_validate(schedule_data.model_dump(), strict=True)
+    assert all(entry.estimated_hours >= 0 for entry in schedule_data.plan), \
+        "Hours should be non-negative (0 for breaks is allowed)"
+
+    validate_markdown_table(response.text)
+    assert plan_to_markdown(schedule_data) in response.text, \
+        "The plan's table rows should match raw_schedule"
 
     return schedule_data
 
 # Determinism Tests
 
 
-@pytest.mark.asyncio
-async def test_basic_output_determinism():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_basic_output_determinism(runner):
     """Checks if the agent consistently returns valid structured data."""
     mock_input = "Course: AI 101. Textbook covers: Neural Networks, Search, and Logic."
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
+    response = await get_final_response(runner, mock_input)
     validate_schedule_structure(response)
 
 
-@pytest.mark.asyncio
-async def test_repeated_runs_determinism():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_repeated_runs_determinism(runner):
     """
     Tests determinism by running the same input multiple times.
     While LLM outputs may vary slightly, structural properties should be consistent.
     """
-    mock_input = "Course: Math 101. Topics: Calculus, Linear Algebra, Probability."
-
-    responses = []
-    for i in range(3):
-        runner = Runner(
-            app_name=f"bxtheory tests run {i}",
-            agent=root_agent,
-            session_service=InMemorySessionService()
-        )
-        response = get_final_response(
-            runner, mock_input, session_id=f"session_{i}")
-        responses.append(response)
+    message = create_message(
+        "Course: Math 101. Topics: Calculus, Linear Algebra, Probability.")
+
+    responses = await asyncio.gather(*(
+        get_final_response(runner, message=message, session_id=f"repeat_{i}")
+        for i in range(3)
+    ))
 
     for i, response in enumerate(responses):
         schedule = validate_schedule_structure(response)
@@ -179,36 +281,19 @@ async def test_repeated_runs_determinism():
                 i}: Day {entry.day} exceeds 4 hours"
 
 
-@pytest.mark.asyncio
-async def test_schema_determinism():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_schema_determinism(runner):
     """Tests that output schemas are consistently enforced."""
     mock_input = "Course: Data Structures. Chapters: Arrays, Trees, Graphs, Hash Tables."
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
+    response = await get_final_response(runner, mock_input)
 
     topics = response.output_data.get("topics")
     assert topics is not None, "topics should be extracted"
     assert isinstance(topics, TopicList), "topics should be TopicList type"
-    assert hasattr(topics, 'course_name'), "TopicList should have course_name"
-    assert hasattr(topics, 'chapters'), "TopicList should have chapters"
-    assert isinstance(topics.chapters, list), "chapters should be a list"
-    assert hasattr(topics, 'total_pages'), "TopicList should have total_pages"
-
-    if len(topics.chapters) > 0:
-        first_chapter = topics.chapters[0]
-        assert isinstance(first_chapter, (Chapter, dict)
-                          ), "chapters should contain Chapter objects or dicts"
-        if isinstance(first_chapter, Chapter):
-            assert hasattr(first_chapter, 'name'), "Chapter should have name"
-            assert hasattr(
-                first_chapter, 'page_count'), "Chapter should have page_count"
-            assert hasattr(
-                first_chapter, 'topics'), "Chapter should have topics"
-            assert hasattr(
-                first_chapter, 'estimated_complexity'), "Chapter should have estimated_complexity"
+    assert all(isinstance(c, Chapter) for c in topics.chapters), \
+        "chapters should contain Chapter objects"
+    TopicList.model_validate(topics.model_dump(), strict=True)
 
     schedule = response.output_data.get("raw_schedule")
     assert schedule is not None, "raw_schedule should exist"
@@ -226,16 +311,12 @@ async def test_schema_determinism():
 
 # Contraint tests
 
-@pytest.mark.asyncio
-async def test_four_hour_daily_constraint():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_four_hour_daily_constraint(runner):
     """Verifies that the SchedulerAgent follows the 4-hour/day maximum."""
     mock_input = "Chapters: 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12."
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
-    plan = response.output_data["raw_schedule"].plan
+    plan = (await get_schedule_only(runner, mock_input)).plan
 
     violations = []
     for entry in plan:
@@ -246,8 +327,8 @@ async def test_four_hour_daily_constraint():
     assert len(violations) == 0, f"4-hour constraint violated: {violations}"
 
 
-@pytest.mark.asyncio
-async def test_weekly_break_constraint():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_weekly_break_constraint(runner):
     """Verifies that schedules include breaks (lower study hours periodically)."""
     mock_input = """
     Course: Advanced Mathematics.
@@ -255,11 +336,7 @@ async def test_weekly_break_constraint():
     5. Algebra, 6. Geometry, 7. Calculus I, 8. Calculus II
     """
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
-    plan = response.output_data["raw_schedule"].plan
+    plan = (await get_schedule_only(runner, mock_input)).plan
 
     hours_list = [entry.estimated_hours for entry in plan]
 
@@ -268,36 +345,28 @@ async def test_weekly_break_constraint():
         plan) < 7, "Schedule should include variation for breaks"
 
 
-@pytest.mark.asyncio
-async def test_positive_hours_constraint():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_positive_hours_constraint(runner):
     """Ensures all scheduled hours are non-negative (0 allowed for breaks)."""
     mock_input = "Short course with 3 topics: A, B, C."
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
-    plan = response.output_data["raw_schedule"].plan
+    plan = (await get_schedule_only(runner, mock_input)).plan
 
     for entry in plan:
         assert entry.estimated_hours >= 0, f"Day {
             entry.day} has negative hours: {entry.estimated_hours}"
 
-        if 'break' not in entry.task.lower() and 'break' not in entry.chapter.lower() and 'rest' not in entry.task.lower():
+        if not BREAK_TASK_RE.search(entry.task) and not BREAK_CHAPTER_RE.search(entry.chapter):
             assert entry.estimated_hours > 0, f"Non-break day {
                 entry.day} should have positive hours: {entry.estimated_hours}"
 
 
-@pytest.mark.asyncio
-async def test_sequential_days():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_sequential_days(runner):
     """Verifies that days are numbered sequentially."""
     mock_input = "Course with 5 chapters."
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
-    plan = response.output_data["raw_schedule"].plan
+    plan = (await get_schedule_only(runner, mock_input)).plan
 
     days = [entry.day for entry in plan]
 
@@ -307,14 +376,9 @@ async def test_sequential_days():
 
 # Course Materials Tests
 
-@pytest.mark.asyncio
-async def test_math_135_course_notes():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_math_135_course_notes(runner, math_135_path):
     """Tests agent with actual Math 135 course PDF."""
-    math_135_path = NOTES_DIR / "Math_135.pdf"
-
-    if not math_135_path.exists():
-        pytest.skip("Math 135 PDF not found")
-
     input_text = f"""
     I have the textbook "Language and Proofs in Algebra: An Introduction" for Math 135.
     The course covers: Introduction to Language of Mathematics, Logical Analysis,
@@ -323,10 +387,7 @@ async def test_math_135_course_notes():
     and Complex Numbers.
     """
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, input_text)
+    response = await get_final_response(runner, input_text)
     schedule = validate_schedule_structure(response)
 
     # Should generate a reasonable schedule for this content
@@ -339,48 +400,90 @@ async def test_math_135_course_notes():
         "Schedule should reference mathematical topics"
 
 
-@pytest.mark.asyncio
-async def test_math_136_course():
-    """Tests with Math 136 course content."""
-    input_text = """
-    Course: Math 136 - Linear Algebra 1
-    Topics: Systems of linear equations, Matrix algebra, Determinants,
-    Vector spaces, Linear transformations, Eigenvalues and eigenvectors
-    """
-
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, input_text)
-    schedule = validate_schedule_structure(response)
-
+def _check_math_136(response, schedule):
+    """The course is recognised as Math 136 / Linear Algebra."""
     topics = response.output_data.get("topics")
     assert topics is not None
     assert "136" in topics.course_name or "linear" in topics.course_name.lower()
 
 
-@pytest.mark.asyncio
-async def test_stat_230_course():
-    """Tests with STAT 230 probability course."""
-    input_text = """
+def _check_stat_230(response, schedule):
+    """The course is recognised as STAT 230 / Probability."""
+    topics = response.output_data.get("topics")
+    assert "probability" in topics.course_name.lower() or "230" in topics.course_name
+
+
+def _check_minimal(response, schedule):
+    """Even a one-topic course gets at least one study day."""
+    assert len(schedule.plan) >= 1
+
+
+def _check_extensive(response, schedule):
+    """Many chapters span several days, none over 4 hours."""
+    assert len(
+        schedule.plan) >= 5, "Extensive content should require multiple days"
+
+    for entry in schedule.plan:
+        assert entry.estimated_hours <= 4.0
+
+
+def _check_none(response, schedule):
+    """No check beyond validate_schedule_structure."""
+
+
+# Single-prompt tests: each sends one prompt, validates the schedule and runs a
+# case-specific check. Entries are (docstring, prompt, check). Generated as
+# separate tests rather than through pytest.mark.parametrize, which
+# pytest-asyncio-concurrent does not support.
+SINGLE_PROMPT_CASES = {
+    # Course Materials
+    "math_136_course": ("Tests with Math 136 course content.", """
+    Course: Math 136 - Linear Algebra 1
+    Topics: Systems of linear equations, Matrix algebra, Determinants,
+    Vector spaces, Linear transformations, Eigenvalues and eigenvectors
+    """, _check_math_136),
+    "stat_230_course": ("Tests with STAT 230 probability course.", """
     STAT 230: Probability
     Chapters: Introduction to Probability, Conditional Probability,
     Discrete Random Variables, Continuous Random Variables,
     Joint Distributions, Sampling Distributions
-    """
+    """, _check_stat_230),
+    # Edge Cases
+    "minimal_input": ("Tests agent with minimal information.",
+                      "Course: Basic Math. Topic: Addition.", _check_minimal),
+    "extensive_course_content": (
+        "Tests with extensive course content (many chapters).",
+        "Advanced Course with many topics: "
+        + ", ".join([f"Chapter {i}" for i in range(1, 21)]),
+        _check_extensive),
+    "special_characters_in_input": (
+        "Tests handling of special characters in course content.", """
+    Course: Advanced Topics in C++ & Python
+    Chapters: 1. Pointers & References, 2. Lambda Functions -> Closures,
+    3. Templates<T>, 4. STL: Vectors/Maps, 5. Async/Await
+    """, _check_none),
+}
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
 
-    response = get_final_response(runner, input_text)
-    schedule = validate_schedule_structure(response)
+def _single_prompt_test(name, doc, prompt, check):
+    """Builds the named test for one SINGLE_PROMPT_CASES entry."""
+    @pytest.mark.asyncio_concurrent(group="agents")
+    async def test(runner):
+        response = await get_final_response(runner, prompt)
+        schedule = validate_schedule_structure(response)
+        check(response, schedule)
 
-    topics = response.output_data.get("topics")
-    assert "probability" in topics.course_name.lower() or "230" in topics.course_name
+    test.__name__ = test.__qualname__ = f"test_{name}"
+    test.__doc__ = doc
+    return test
 
 
-@pytest.mark.asyncio
-async def test_multiple_courses_extraction():
+for _name, (_doc, _prompt, _check) in SINGLE_PROMPT_CASES.items():
+    globals()[f"test_{_name}"] = _single_prompt_test(_name, _doc, _prompt, _check)
+
+
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_multiple_courses_extraction(runner):
     """Tests extraction from multiple course descriptions."""
     test_cases = [
         ("Math 137: Calculus 1. Chapters: Limits, Derivatives, Integrals", "calculus"),
@@ -388,11 +491,12 @@ async def test_multiple_courses_extraction():
         ("CS 101: Introduction to Programming. Course covers: Variables, Loops, Functions, Data Structures", "programming"),
     ]
 
-    for course_input, expected_keyword in test_cases:
-        runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                        session_service=InMemorySessionService())
+    responses = await asyncio.gather(*(
+        get_final_response(runner, course_input, session_id=f"multi_{i}")
+        for i, (course_input, _) in enumerate(test_cases)
+    ))
 
-        response = get_final_response(runner, course_input)
+    for (course_input, expected_keyword), response in zip(test_cases, responses):
         topics = response.output_data.get("topics")
 
         assert topics is not None, f"Failed to extract topics from: {
@@ -401,68 +505,16 @@ async def test_multiple_courses_extraction():
             f"Failed to extract course name from: {course_input}"
 
 
-# Edge Cases Tests
-
-@pytest.mark.asyncio
-async def test_minimal_input():
-    """Tests agent with minimal information."""
-    minimal_input = "Course: Basic Math. Topic: Addition."
-
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, minimal_input)
-    schedule = validate_schedule_structure(response)
-
-    assert len(schedule.plan) >= 1
-
-
-@pytest.mark.asyncio
-async def test_extensive_course_content():
-    """Tests with extensive course content (many chapters)."""
-    chapters = ", ".join([f"Chapter {i}" for i in range(1, 21)])
-    extensive_input = f"Advanced Course with many topics: {chapters}"
-
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, extensive_input)
-    schedule = validate_schedule_structure(response)
-
-    assert len(
-        schedule.plan) >= 5, "Extensive content should require multiple days"
-
-    for entry in schedule.plan:
-        assert entry.estimated_hours <= 4.0
-
-
-@pytest.mark.asyncio
-async def test_special_characters_in_input():
-    """Tests handling of special characters in course content."""
-    special_input = """
-    Course: Advanced Topics in C++ & Python
-    Chapters: 1. Pointers & References, 2. Lambda Functions -> Closures,
-    3. Templates<T>, 4. STL: Vectors/Maps, 5. Async/Await
-    """
-
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, special_input)
-    validate_schedule_structure(response)
-
-
 # Performance Tests
 
-@pytest.mark.asyncio
-async def test_performance_latency():
+# Own group, so the timed run does not compete with the "agents" group for
+# quota and the event loop; separate groups run one after another
+@pytest.mark.asyncio_concurrent(group="perf")
+async def test_performance_latency(runner):
     """Measures execution time to ensure it meets 'Fast' requirements."""
     start_time = time.perf_counter()
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    get_final_response(
+    await get_final_response(
         runner, "Sample textbook content for performance testing.")
 
     duration = time.perf_counter() - start_time
@@ -471,8 +523,8 @@ async def test_performance_latency():
     assert duration < 60.0
 
 
-@pytest.mark.asyncio
-async def test_concurrent_sessions():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_concurrent_sessions(runner):
     """Tests that multiple sessions can run independently."""
     inputs = [
         "Course A: Topic 1, Topic 2",
@@ -480,16 +532,10 @@ async def test_concurrent_sessions():
         "Course C: Topic 5, Topic 6"
     ]
 
-    responses = []
-    for i, input_text in enumerate(inputs):
-        runner = Runner(
-            app_name=f"bxtheory tests session {i}",
-            agent=root_agent,
-            session_service=InMemorySessionService()
-        )
-        response = get_final_response(
-            runner, input_text, session_id=f"concurrent_{i}")
-        responses.append(response)
+    responses = await asyncio.gather(*(
+        get_final_response(runner, input_text, session_id=f"concurrent_{i}")
+        for i, input_text in enumerate(inputs)
+    ))
 
     # Each session should produce valid output
     for i, response in enumerate(responses):
@@ -498,20 +544,13 @@ async def test_concurrent_sessions():
 
 # Session Persistence Tests
 
-@pytest.mark.asyncio
-async def test_session_isolation():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_session_isolation(runner):
     """Tests that sessions are properly isolated."""
-    session_service = InMemorySessionService()
-
-    runner1 = Runner(app_name="bxtheory tests", agent=root_agent,
-                     session_service=session_service)
-    response1 = get_final_response(runner1, "Course X: Topics A, B",
-                                   session_id="session_1")
-
-    runner2 = Runner(app_name="bxtheory tests", agent=root_agent,
-                     session_service=session_service)
-    response2 = get_final_response(runner2, "Course Y: Topics C, D",
-                                   session_id="session_2")
+    response1 = await get_final_response(runner, "Course X: Topics A, B",
+                                         session_id="isolation_1")
+    response2 = await get_final_response(runner, "Course Y: Topics C, D",
+                                         session_id="isolation_2")
 
     validate_schedule_structure(response1)
     validate_schedule_structure(response2)
@@ -527,38 +566,553 @@ async def test_session_isolation():
 # Output Format Tests
 
 
-@pytest.mark.asyncio
-async def test_markdown_table_format():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_markdown_table_format(runner):
     """Validates that the markdown table is properly formatted."""
     mock_input = "Simple course: Topic A, Topic B, Topic C"
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
-
-    lines = response.text.strip().split('\n')
-
-    table_lines = [l for l in lines if '|' in l]
-    assert len(table_lines) >= 2, "Should have at least header and one data row"
+    response = await get_final_response(runner, mock_input)
 
-    header = table_lines[0].lower()
-    assert 'day' in header
-    assert 'task' in header or 'topic' in header
-    assert 'hour' in header
+    validate_markdown_table(response.text)
 
 
-@pytest.mark.asyncio
-async def test_output_completeness():
+@pytest.mark.asyncio_concurrent(group="agents")
+async def test_output_completeness(runner):
     """Ensures all pipeline stages contribute to final output."""
     mock_input = "Course: Test. Chapters: 1, 2, 3."
 
-    runner = Runner(app_name="bxtheory tests", agent=root_agent,
-                    session_service=InMemorySessionService())
-
-    response = get_final_response(runner, mock_input)
+    response = await get_final_response(runner, mock_input)
 
     assert "topics" in response.output_data, "ExtractorAgent output missing"
     assert "raw_schedule" in response.output_data, "SchedulerAgent output missing"
     assert response.text and len(
         response.text) > 0, "FormatterAgent output missing"
+
+
+# Pipeline Helper Tests
+
+def test_merge_topic_lists_combines_textbooks():
+    """Per-textbook extractions merge into one TopicList for the scheduler."""
+    math = TopicList(course_name="Math 135", total_pages=60, chapters=[
+        Chapter(name="Proofs", page_count=60, topics=["Induction"],
+                estimated_complexity="high"),
+    ], exam_topics=["Induction"], exam_date="2026-02-20",
+        max_daily_hours=3.0).model_dump(exclude_none=True)
+    stat = TopicList(course_name="STAT 230", total_pages=40, chapters=[
+        Chapter(name="Probability", page_count=40, topics=["Counting"],
+                estimated_complexity="medium"),
+    ], exam_date="2026-02-18").model_dump(exclude_none=True)
+
+    merged = TopicList(**merge_topic_lists([math, stat]))
+
+    assert merged.course_name == "Math 135 + STAT 230"
+    assert merged.total_pages == 100
+    assert [(c.course, c.name) for c in merged.chapters] == [
+        ("Math 135", "Proofs"), ("STAT 230", "Probability")]
+    assert merged.exam_topics == ["Induction"]
+    assert merged.exam_date == "2026-02-18"
+    assert merged.max_daily_hours == 3.0
+    assert merge_topic_lists([math]) is math
+
+
+def test_extraction_cache_key_covers_pdf_and_text():
+    """The same PDF with different instructions is extracted separately."""
+    pdf = Part.from_bytes(data=b"%PDF-1.4 textbook", mime_type="application/pdf")
+    other = Part.from_bytes(data=b"%PDF-1.4 other", mime_type="application/pdf")
+
+    key = _extraction_cache_key(pdf, "Plan my midterm.")
+    assert key == _extraction_cache_key(pdf, "Plan my midterm.")
+    assert key != _extraction_cache_key(pdf, "Only chapters 1-4 are on the midterm.")
+    assert key != _extraction_cache_key(other, "Plan my midterm.")
+
+
+def test_from_state_skips_revalidation():
+    """Validated state dicts rebuild into models without a second validation pass."""
+    plan = FullPlan(plan=[
+        StudyDay(day=1, course="Math 135", chapter="Proofs", task="Read",
+                 estimated_hours=2.0),
+    ], total_study_days=1, total_hours=2.0)
+
+    rebuilt = FullPlan.from_state(plan.model_dump(exclude_none=True))
+
+    assert isinstance(rebuilt.plan[0], StudyDay)
+    assert rebuilt.plan[0].date is None
+    assert rebuilt == plan
+
+    # Out-of-schema values pass through untouched, proving no validation ran
+    topics = TopicList.from_state({"course_name": "Math 135", "total_pages": "many",
+                                   "chapters": [{"name": "Sets", "page_count": -1}]})
+    assert topics.total_pages == "many"
+    assert topics.chapters[0].page_count == -1
+    with pytest.raises(ValueError):
+        TopicList.from_state({"course_name": "Math 135"})
+
+
+def test_schedule_from_topics_constraints():
+    """The deterministic scheduler honours the 4-hour, break and numbering rules."""
+    topics = TopicList(course_name="Math 135", total_pages=400, chapters=[
+        Chapter(name=f"Chapter {i}", page_count=50, topics=[],
+                estimated_complexity=complexity)
+        for i, complexity in enumerate(["high", "medium", "low"] * 3, 1)
+    ])
+
+    schedule = schedule_from_topics(topics, start=date(2026, 2, 9))
+
+    assert [entry.day for entry in schedule.plan] == list(
+        range(1, len(schedule.plan) + 1))
+    assert schedule.plan[0].date == "2026-02-09"
+    assert all(0 <= entry.estimated_hours <= 4.0 for entry in schedule.plan)
+    for week_end in range(7, len(schedule.plan) + 1, 7):
+        assert schedule.plan[week_end - 1].estimated_hours == 0
+        assert "break" in schedule.plan[week_end - 1].task.lower()
+    assert "review" in schedule.plan[-1].task.lower()
+    assert schedule.total_study_days == sum(
+        1 for entry in schedule.plan if entry.estimated_hours > 0)
+    assert schedule.total_hours == sum(
+        entry.estimated_hours for entry in schedule.plan)
+    assert FullPlan.model_validate(schedule.model_dump()) == schedule
+    assert schedule.exam_date is None and schedule.fits_before_exam is None
+
+
+def test_schedule_from_topics_keeps_course_per_day():
+    """Merged textbooks keep their own course on each study day."""
+    topics = TopicList(**merge_topic_lists([
+        TopicList(course_name=course, total_pages=80, chapters=[
+            Chapter(name=name, page_count=40, topics=[], estimated_complexity="high")
+            for name in names
+        ]).model_dump(exclude_none=True)
+        for course, names in [("Math 135", ["Sets", "Proofs"]),
+                              ("STAT 230", ["Counting", "Bayes"])]
+    ]))
+
+    plan = schedule_from_topics(topics, start=date(2026, 2, 9)).plan
+
+    assert [(d.course, d.chapter) for d in plan[:4]] == [
+        ("Math 135", "Sets"), ("Math 135", "Proofs"),
+        ("STAT 230", "Counting"), ("STAT 230", "Bayes")]
+    assert plan[-1].course == "Math 135 + STAT 230"
+
+
+def test_schedule_from_topics_honours_daily_limit():
+    """A user's "max N hours per day" caps every day below MAX_DAILY_HOURS."""
+    topics = TopicList(course_name="Math 135", total_pages=120, chapters=[
+        Chapter(name="Proofs", page_count=120, topics=[], estimated_complexity="high"),
+    ], max_daily_hours=2.5)
+
+    plan = schedule_from_topics(topics).plan
+
+    assert max(d.estimated_hours for d in plan) == 2.5
+    assert plan[0].chapter == "Proofs (part 1/4)"
+
+
+@pytest.mark.parametrize("exam_date,fits,breaks", [
+    ("2026-03-31", True, True),    # plenty of time: break days kept
+    ("02-18", True, False),        # tight: fits only without break days
+    ("2026-02-12", False, False),  # too close: flagged, full plan kept
+])
+def test_schedule_from_topics_fits_exam_date(exam_date, fits, breaks):
+    """Plans are fitted before the exam, or flagged when they cannot be."""
+    topics = TopicList(course_name="Math 135", total_pages=320, chapters=[
+        Chapter(name=f"Chapter {i}", page_count=40, topics=[],
+                estimated_complexity="high")
+        for i in range(1, 9)
+    ], exam_date=exam_date)
+
+    plan = schedule_from_topics(topics, start=date(2026, 2, 9))
+
+    assert plan.fits_before_exam is fits
+    assert plan.exam_date == "2026-" + exam_date[-5:]
+    assert any(d.task == "Break day" for d in plan.plan) is breaks
+    assert plan.total_study_days == 9
+    if fits:
+        assert plan.plan[-1].date < plan.exam_date
+    assert ("Warning" in plan_to_markdown(plan)) is not fits
+
+
+def test_schedule_from_topics_splits_long_chapters():
+    """Chapters needing more than a day are split into parts."""
+    topics = TopicList(course_name="STAT 230", total_pages=150, chapters=[
+        Chapter(name="Probability", page_count=150, topics=[],
+                estimated_complexity="high"),
+    ])
+
+    plan = schedule_from_topics(topics).plan
+
+    assert [entry.chapter for entry in plan[:4]] == [
+        f"Probability (part {i}/4)" for i in range(1, 5)]
+
+
+@pytest.mark.parametrize("complexity", ["High", "HIGH", " high "])
+def test_schedule_from_topics_normalises_complexity(complexity):
+    """Complexity labels are matched regardless of case and whitespace."""
+    def total_hours(label):
+        return schedule_from_topics(TopicList(course_name="Math 135", total_pages=40, chapters=[
+            Chapter(name="Proofs", page_count=40, topics=[], estimated_complexity=label),
+        ])).total_hours
+
+    assert total_hours(complexity) == total_hours("high") > total_hours("medium")
+
+
+def test_plan_to_markdown_renders_one_row_per_day():
+    """The formatter's input table has a header and one escaped, single-line row per day."""
+    plan = FullPlan(plan=[
+        StudyDay(day=1, date="2026-02-09", course="C++ | Python",
+                 chapter="Pointers", task="Read\nsections 1-3", estimated_hours=2.0),
+        StudyDay(day=2, course="-", chapter="-", task="Break day",
+                 estimated_hours=0.0),
+    ], total_study_days=1, total_hours=2.0)
+
+    lines = plan_to_markdown(plan).splitlines()
+
+    assert lines[0] == "| Day | Date | Course | Chapter | Task | Hours |"
+    assert lines[2] == "| 1 | 2026-02-09 | C++ \\| Python | Pointers | Read sections 1-3 | 2.0 |"
+    assert lines[3] == "| 2 | - | - | - | Break day | 0.0 |"
+    assert lines[-2] == "Total: 1 study days, 2.0 hours"
+    assert lines[-1].startswith("No exam date given")
+
+
+@pytest.mark.parametrize("description,course_name,chapters", [
+    ("Course: Data Structures. Chapters: Arrays, Trees, Graphs, Hash Tables.",
+     "Data Structures", ["Arrays", "Trees", "Graphs", "Hash Tables"]),
+    ("STAT 230: Probability\nChapters: Conditional Probability,\nJoint Distributions",
+     "STAT 230: Probability", ["Conditional Probability", "Joint Distributions"]),
+    ("Course: Math. Chapters: 1. Set Theory, 2. Logic, and 3. Series and Sequences",
+     "Math", ["Set Theory", "Logic", "Series and Sequences"]),
+    ("My exam is on Feb 20 for Math 135. Topics: Sets, Induction, Congruences.",
+     "Math 135", ["Sets", "Induction", "Congruences"]),
+    ("Course: Intro to Stats, topics: mean, median, variance.",
+     "Intro to Stats", ["mean", "median", "variance"]),
+    ("Course: Math 135. Topics: 1.1 Sets, 1.2 Logic, 2.1 Proofs",
+     "Math 135", ["Sets", "Logic", "Proofs"]),
+])
+def test_text_description_fast_path(description, course_name, chapters):
+    """Plain-text course descriptions are parsed without the ExtractorAgent."""
+    topics = try_extract_from_text_description(description)
+
+    assert topics.course_name == course_name
+    assert [c.name for c in topics.chapters] == chapters
+    assert topics.total_pages == sum(c.page_count for c in topics.chapters)
+
+
+@pytest.mark.parametrize("description,exam_date,max_daily_hours", [
+    ("My exam is on Feb 20 for Math 135. Topics: Sets, Induction, Congruences.",
+     "02-20", None),
+    ("Course: Logic. Chapters: Sets, Proofs. Max 3 hours per day, exam 2026-12-10.",
+     "2026-12-10", 3.0),
+    ("Final exam December 3, 2026. Course: Logic. Chapters: Sets, Proofs",
+     "2026-12-03", None),
+])
+def test_text_description_fast_path_reads_deadline(description, exam_date, max_daily_hours):
+    """The exam date and daily limit in a description reach the scheduler."""
+    topics = try_extract_from_text_description(description)
+
+    assert topics is not None
+    assert topics.exam_date == exam_date
+    assert topics.max_daily_hours == max_daily_hours
+
+
+@pytest.mark.parametrize("description", [
+    "Chapters: 1, 2, 3, 4, 5.",
+    "Course X: Topics A, B",
+    "I have 3 midterms in 2 weeks. Create a study plan.",
+    "Course: Math. Chapters: 1, 2, 3.",
+    "STAT 230: Probability Topics: Counting, Bayes",
+    "I have Math 135 and STAT 230 midterms. Topics: Sets, Induction, Probability, Bayes",
+    "Chapters: Sets (30 pages), Logic (120 pages), Proofs (10 pages)",
+    "Topics: e.g. sets, proofs, etc.",
+    "Only chapters: 1-4 are on the midterm",
+    "Chapters: cells, DNA, evolution — the last one is hard, please give it more time.",
+    "ABC 123 is my sku. Topics: anything",
+    # The same prompts with a course label, so a course is always found
+    "Course: Logic. Chapters: Sets (30 pages), Logic (120 pages), Proofs (10 pages)",
+    "Course: Logic. Topics: e.g. sets, proofs, etc.",
+    "Course: Logic. Only chapters: 1-4 are on the midterm",
+    "Course: Biology. Chapters: cells, DNA, evolution — the last one is hard, please give it more time.",
+    "Course: Biology. Chapters: cells, DNA, evolution\nThe last one is hard.",
+])
+def test_text_description_fast_path_defers_to_extractor(description):
+    """Descriptions without a clear course name and chapter list go to the LLM."""
+    assert try_extract_from_text_description(description) is None
+
+
+# Batch Generation Tests
+
+BATCH_TOPICS_JSON = (
+    '{"course_name": "Math 135", "total_pages": 80, "chapters": ['
+    '{"name": "Sets", "page_count": 40, "topics": [], "estimated_complexity": "low"}, '
+    '{"name": "Proofs", "page_count": 40, "topics": [], "estimated_complexity": "high"}]}'
+)
+
+
+def batch_response(text):
+    """Builds one inline batch result whose model reply is `text`."""
+    return types.InlinedResponse(response=types.GenerateContentResponse(
+        candidates=[types.Candidate(content=Content(parts=[Part(text=text)], role='model'))]))
+
+
+def run_coroutine(coro):
+    """Runs `coro` on a private loop, from a sync test.
+
+    asyncio.run would unset the thread's event loop afterwards, which
+    pytest-asyncio-concurrent still needs for the async test groups.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeBatches:
+    """Stands in for client.aio.batches: the job finishes on the first poll."""
+
+    def __init__(self, final_state, responses=()):
+        self.final_state = final_state
+        self.responses = list(responses)
+        self.requests = []
+
+    async def create(self, model, src, config=None):
+        self.requests = src
+        return types.BatchJob(name="batches/test", state=types.JobState.JOB_STATE_RUNNING)
+
+    async def get(self, name):
+        return types.BatchJob(
+            name=name,
+            state=self.final_state,
+            dest=types.BatchJobDestination(inlined_responses=self.responses),
+        )
+
+
+class FakeClient:
+    """A genai.Client stand-in exposing only aio.batches."""
+
+    def __init__(self, batches):
+        self.aio = type("Aio", (), {"batches": batches})()
+
+
+@pytest.mark.parametrize("item", [
+    None,
+    types.InlinedResponse(error=types.JobError(code=500, message="internal")),
+    types.InlinedResponse(),
+    batch_response("not json"),
+], ids=["missing", "error", "empty", "invalid_json"])
+def test_plan_from_response_rejects_failed_items(item):
+    """Failed, empty or unparsable batch results yield no plan."""
+    assert _plan_from_response(item) is None
+
+
+def test_batch_generate_plans_pads_missing_responses():
+    """Each message gets a slot, in order, even when results are missing."""
+    batches = FakeBatches(types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+                          [batch_response(BATCH_TOPICS_JSON)])
+    messages = [create_message("Math 135 textbook"), create_message("Math 136 textbook")]
+
+    plans = run_coroutine(batch_generate_plans(
+        messages, client=FakeClient(batches), poll_interval=0))
+
+    assert len(batches.requests) == 2
+    assert len(plans) == 2
+    assert isinstance(plans[0], FullPlan) and plans[0].total_study_days > 0
+    assert plans[1] is None
+
+
+@pytest.mark.parametrize("state", [
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+])
+def test_batch_generate_plans_raises_on_unsuccessful_job(state):
+    """A batch job that does not succeed raises instead of returning plans."""
+    batches = FakeBatches(state)
+
+    with pytest.raises(RuntimeError, match="batches/test"):
+        run_coroutine(batch_generate_plans(
+            [create_message("Math 135 textbook")],
+            client=FakeClient(batches), poll_interval=0))
+
+
+# Stub Model Tests
+
+class StubLlm(BaseLlm):
+    """An offline model that records each request and answers with `reply`."""
+
+    model: str = "stub"
+    reply: Callable[[LlmRequest], str]
+    requests: list = []
+
+    async def generate_content_async(self, llm_request, stream=False):
+        self.requests.append(llm_request)
+        yield LlmResponse(content=Content(
+            parts=[Part(text=self.reply(llm_request))], role='model'))
+
+
+def request_pdfs(llm_request) -> List[bytes]:
+    """Returns the bytes of every PDF in a model request."""
+    return [part.inline_data.data for content in llm_request.contents
+            for part in content.parts or [] if part.inline_data]
+
+
+def stub_topics(llm_request) -> str:
+    """Replies to the extractor with two chapters of a course named after its PDF."""
+    pdfs = request_pdfs(llm_request)
+    return json.dumps({
+        "course_name": pdfs[0].decode() if pdfs else "Text course",
+        "total_pages": 80,
+        "chapters": [
+            {"name": "Sets", "page_count": 40, "topics": [], "estimated_complexity": "low"},
+            {"name": "Proofs", "page_count": 40, "topics": [], "estimated_complexity": "high"},
+        ],
+    })
+
+
+def pdf_part(data: bytes) -> Part:
+    """Builds an uploaded-PDF message part."""
+    return Part.from_bytes(data=data, mime_type="application/pdf")
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    """Swaps the extractor and formatter models for stubs and empties the cache."""
+    extractor_llm = StubLlm(reply=stub_topics)
+    formatter_llm = StubLlm(reply=lambda llm_request: "# Study Schedule")
+    monkeypatch.setattr(extractor, "model", extractor_llm)
+    monkeypatch.setattr(formatter, "model", formatter_llm)
+    monkeypatch.setattr(planner, "_extraction_cache", OrderedDict())
+    return extractor_llm, formatter_llm
+
+
+async def run_events(message, app_name="stub tests"):
+    """Runs one message through a fresh runner and returns every event."""
+    stub_runner = Runner(app_name=app_name, agent=root_agent,
+                         session_service=InMemorySessionService())
+    session = await stub_runner.session_service.create_session(
+        app_name=app_name, user_id="stub_user")
+    return [event async for event in stub_runner.run_async(
+        user_id="stub_user", session_id=session.id, new_message=message)]
+
+
+def topics_delta(events) -> dict:
+    """Returns the merged `topics` written by TextbookExtraction."""
+    return next(event.actions.state_delta["topics"] for event in events
+                if event.author == "TextbookExtraction"
+                and "topics" in event.actions.state_delta)
+
+
+def test_extraction_cache_hit_skips_extractor(stub_models):
+    """A miss writes through to the cache; a hit runs no clone and gets a deep copy."""
+    extractor_llm, _ = stub_models
+    message = Content(parts=[Part(text="Plan my midterm."), pdf_part(b"Math 135")],
+                      role='user')
+    key = _extraction_cache_key(message.parts[1], "Plan my midterm.")
+
+    first = topics_delta(run_coroutine(run_events(message)))
+
+    assert len(extractor_llm.requests) == 1
+    assert planner._extraction_cache[key] == first
+    assert planner._extraction_cache[key] is not first
+
+    events = run_coroutine(run_events(message))
+    second = topics_delta(events)
+
+    assert len(extractor_llm.requests) == 1
+    assert not any(event.author.startswith(extractor.name) for event in events)
+    assert second == first
+    assert second is not planner._extraction_cache[key]
+    assert second["chapters"][0] is not planner._extraction_cache[key]["chapters"][0]
+
+
+def test_extraction_cache_evicts_least_recently_used(monkeypatch):
+    """The cache keeps at most _EXTRACTION_CACHE_MAX entries, dropping the stalest."""
+    monkeypatch.setattr(planner, "_extraction_cache", OrderedDict())
+    monkeypatch.setattr(planner, "_EXTRACTION_CACHE_MAX", 2)
+
+    _cache_extraction("a", {"course_name": "A"})
+    _cache_extraction("b", {"course_name": "B"})
+    assert _cached_extraction("a") == {"course_name": "A"}
+    _cache_extraction("c", {"course_name": "C"})
+
+    assert list(planner._extraction_cache) == ["a", "c"]
+    assert _cached_extraction("b") is None
+
+
+def test_fan_out_restricts_each_clone_to_its_pdf(stub_models):
+    """Each extractor clone sees only its own textbook, and all results are merged."""
+    extractor_llm, _ = stub_models
+    message = Content(parts=[Part(text="Plan both midterms."),
+                             pdf_part(b"Math 135"), pdf_part(b"STAT 230")], role='user')
+
+    topics = TopicList.from_state(topics_delta(run_coroutine(run_events(message))))
+
+    assert sorted(request_pdfs(r) for r in extractor_llm.requests) == [
+        [b"Math 135"], [b"STAT 230"]]
+    assert topics.course_name == "Math 135 + STAT 230"
+    assert [(c.course, c.name) for c in topics.chapters] == [
+        ("Math 135", "Sets"), ("Math 135", "Proofs"),
+        ("STAT 230", "Sets"), ("STAT 230", "Proofs")]
+
+
+def test_fan_out_falls_back_when_a_clone_writes_nothing(stub_models):
+    """A clone with no TopicList hands the whole message to the plain extractor."""
+    extractor_llm, _ = stub_models
+    extractor_llm.reply = lambda llm_request: (
+        "" if request_pdfs(llm_request) == [b"Broken"] else stub_topics(llm_request))
+    message = Content(parts=[Part(text="Plan both midterms."),
+                             pdf_part(b"Math 135"), pdf_part(b"Broken")], role='user')
+
+    events = run_coroutine(run_events(message))
+
+    assert request_pdfs(extractor_llm.requests[-1]) == [b"Math 135", b"Broken"]
+    topics = [event.actions.state_delta["topics"] for event in events
+              if "topics" in event.actions.state_delta]
+    assert [t["course_name"] for t in topics] == ["Math 135"]
+    assert not any(event.author == "TextbookExtraction"
+                   and "topics" in event.actions.state_delta for event in events)
+
+
+def test_formatter_appends_schedule_table(stub_models):
+    """The formatter model writes only the intro; the plan's table is raw_schedule's."""
+    _, formatter_llm = stub_models
+
+    events = run_coroutine(run_events(create_message(
+        "Course: Logic. Chapters: Sets, Proofs, Induction.")))
+
+    state = {}
+    for event in events:
+        state.update(event.actions.state_delta)
+    table = plan_to_markdown(FullPlan.from_state(state["raw_schedule"]))
+    assert table == state["schedule_table"]
+    assert state["study_plan"] == f"# Study Schedule\n\n{table}"
+    assert table in str(formatter_llm.requests[0].config.system_instruction)
+    assert events[-1].author == formatter.name
+    assert events[-1].content.parts[0].text == table
+
+
+def test_create_study_plan_builds_runner_lazily(stub_models, monkeypatch):
+    """create_study_plan builds the shared runner on first use and returns the plan."""
+    monkeypatch.setattr(planner, "_runner", None)
+
+    plan = run_coroutine(create_study_plan(
+        "Course: Logic. Chapters: Sets, Proofs.", session_id="lazy_runner"))
+
+    assert planner._runner is not None and get_runner() is planner._runner
+    assert plan.startswith("# Study Schedule\n\n| Day | Date | Course |")
+    assert "| Logic | Sets, Proofs |" in plan
+
+
+@pytest.mark.parametrize("text,valid", [
+    (plan_to_markdown(FullPlan(plan=[
+        StudyDay(day=1, course="C++ | Python", chapter="Pointers", task="Read",
+                 estimated_hours=2.0),
+    ], total_study_days=1, total_hours=2.0)), True),
+    ("| Hours | Task | Day |\n|:--|--|--:|\n| 2.0 | Read | 1 |", True),
+    ("Each day has a task and a few hours | see below\n| next |", False),
+    ("| Day | Task | Hours |\n|---|---|---|\n| 1 | Read |", False),
+    ("| Day | Chapter | Hours |\n|---|---|---|\n| 1 | Sets | 2.0 |", False),
+    ("| Day | Task | Hours |\n|---|---|---|", False),
+])
+def test_validate_markdown_table(text, valid):
+    """Tables are checked by column name and row width, not by a header regex."""
+    if valid:
+        validate_markdown_table(text)
+    else:
+        with pytest.raises(AssertionError):
+            validate_markdown_table(text)